@@ -1,10 +1,190 @@
+import math
+import os
+import matplotlib
+if os.environ.get('HEADLESS'):
+    matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from numba import njit
 import numpy as np
 import scipy.constants as constants
 import time
 plt.rcParams['font.family'] = ['Arial']
 plt.rcParams['font.size'] = 14
 
+def integrate(rate, initial, dt):
+    """Forward Euler integration of a sampled rate.
+
+    Returns the state at every sample, where the kth entry is the initial
+    value plus the rates of all samples before k.
+    """
+    steps = np.concatenate(([0.0], np.cumsum(rate[:-1])))
+    return initial + steps * dt
+
+
+@njit(cache=True, fastmath=True, inline='always')
+def _predict_P(P, Q, dt, a32, a42, AP):
+    """Overwrite P with A @ P @ A.T + Q, expanded by hand.
+
+    A is the Jacobian of the dynamics: identity plus dt at (0, 3), (1, 4),
+    (2, 5) and a32, a42 at (3, 2), (4, 2), so each product only mixes a
+    handful of rows and columns of P. AP is a 6x6 scratch buffer.
+    """
+    for i in range(6):
+        for j in range(6):
+            AP[i, j] = P[i, j]
+    for j in range(6):
+        AP[0, j] += dt * P[3, j]
+        AP[1, j] += dt * P[4, j]
+        AP[2, j] += dt * P[5, j]
+        AP[3, j] += a32 * P[2, j]
+        AP[4, j] += a42 * P[2, j]
+    for i in range(6):
+        P[i, 0] = AP[i, 0] + dt * AP[i, 3] + Q[i, 0]
+        P[i, 1] = AP[i, 1] + dt * AP[i, 4] + Q[i, 1]
+        P[i, 2] = AP[i, 2] + dt * AP[i, 5] + Q[i, 2]
+        P[i, 3] = AP[i, 3] + a32 * AP[i, 2] + Q[i, 3]
+        P[i, 4] = AP[i, 4] + a42 * AP[i, 2] + Q[i, 4]
+        P[i, 5] = AP[i, 5] + Q[i, 5]
+
+
+@njit(cache=True, fastmath=True, inline='always')
+def _kalman_gain(PCt, S, K):
+    """Solve K @ S = PCt for the Kalman gain, written into K.
+
+    S is the 2x2 innovation covariance of ekf_step, inverted in closed form.
+    """
+    det = S[0, 0] * S[1, 1] - S[0, 1] * S[1, 0]
+    for r in range(PCt.shape[0]):
+        a, b = PCt[r, 0], PCt[r, 1]
+        K[r, 0] = (a * S[1, 1] - b * S[1, 0]) / det
+        K[r, 1] = (b * S[0, 0] - a * S[0, 1]) / det
+
+
+@njit(cache=True, fastmath=True, inline='always')
+def ekf_step(x, u, y, P, Q, R, dt, m, J, lx, ly, lz, new_x, AP, PCt, CP, K,
+             S):
+    """One extended Kalman filter predict/update step, done in place.
+
+    The dynamics g, the measurement model h and their Jacobians are written
+    out inline, so sin/cos of phi and the distance to the landmark are each
+    evaluated once. The new state estimate is written into new_x and P is
+    overwritten with the new covariance. AP, PCt, CP, K and S are scratch
+    buffers of shape (6, 6), (6, 2), (2, 6), (6, 2) and (2, 2).
+    """
+    u_1, u_2 = u[0], u[1]
+    phi, dphi = x[2], x[5]
+    s, c = math.sin(phi), math.cos(phi)
+
+    # g: extrapolated state
+    new_x[0] = x[0] + x[3] * dt
+    new_x[1] = x[1] + x[4] * dt
+    new_x[2] = phi + dphi * dt
+    new_x[3] = x[3] + ((-u_1 * s) / m) * dt
+    new_x[4] = x[4] + (-constants.g + (u_1 * c) / m) * dt
+    new_x[5] = dphi + (u_2 / J) * dt
+
+    # A: only A[3, 2] and A[4, 2] depend on x and u
+    a32 = -(u_1 * c * dphi * dt) / m
+    a42 = -(u_1 * s * dphi * dt) / m
+    _predict_P(P, Q, dt, a32, a42, AP)
+
+    # h and C share the distance to the landmark
+    dx = lx - new_x[0]
+    dz = lz - new_x[1]
+    dist = math.sqrt(dx * dx + ly * ly + dz * dz)
+    inv_dist = 1.0 / dist
+    dh1_dx1 = -dx * inv_dist
+    dh1_dx2 = -dz * inv_dist
+
+    # C only has C[0, 0], C[0, 1] and C[1, 2] = 1 set, so P @ C.T and C @ P
+    # are just combinations of the first three columns and rows of P
+    for k in range(6):
+        PCt[k, 0] = dh1_dx1 * P[k, 0] + dh1_dx2 * P[k, 1]
+        PCt[k, 1] = P[k, 2]
+        CP[0, k] = dh1_dx1 * P[0, k] + dh1_dx2 * P[1, k]
+        CP[1, k] = P[2, k]
+    S[0, 0] = dh1_dx1 * PCt[0, 0] + dh1_dx2 * PCt[1, 0] + R[0, 0]
+    S[0, 1] = dh1_dx1 * PCt[0, 1] + dh1_dx2 * PCt[1, 1] + R[0, 1]
+    S[1, 0] = PCt[2, 0] + R[1, 0]
+    S[1, 1] = PCt[2, 1] + R[1, 1]
+    _kalman_gain(PCt, S, K)
+
+    innovation_0 = y[0] - dist
+    innovation_1 = y[1] - new_x[2]
+    for k in range(6):
+        new_x[k] += K[k, 0] * innovation_0 + K[k, 1] * innovation_1
+    # Joseph form (I - K @ C) @ P @ (I - K @ C).T + K @ R @ K.T, which stays
+    # positive semi-definite for any gain K. With P' = P - K @ (C @ P) it
+    # expands to P' - (P' @ C.T) @ K.T + K @ R @ K.T, so no identity is ever
+    # formed. Evaluated term by term it is only symmetric up to rounding, so
+    # P is symmetrized explicitly at the end.
+    for i in range(6):
+        for j in range(6):
+            P[i, j] -= K[i, 0] * CP[0, j] + K[i, 1] * CP[1, j]
+    for k in range(6):
+        PCt[k, 0] = dh1_dx1 * P[k, 0] + dh1_dx2 * P[k, 1]
+        PCt[k, 1] = P[k, 2]
+    for i in range(6):
+        for j in range(6):
+            acc = -(PCt[i, 0] * K[j, 0] + PCt[i, 1] * K[j, 1])
+            for a in range(2):
+                for b in range(2):
+                    acc += K[i, a] * R[a, b] * K[j, b]
+            P[i, j] += acc
+    for i in range(6):
+        for j in range(i + 1, 6):
+            P[i, j] = P[j, i] = 0.5 * (P[i, j] + P[j, i])
+
+
+@njit(cache=True, fastmath=True, inline='always')
+def ekf_run(U, Y, P, Q, R, dt, m, J, lx, ly, lz, X_hat):
+    """Run ekf_step over a whole data set in one compiled loop.
+
+    X_hat[0] must hold the initial state. Row k is then estimated from row
+    k - 1, input U[k - 1] and measurement Y[k], and P is left holding the
+    final covariance. The recursion is sequential, but the scratch buffers
+    are allocated once and no sample goes back through Python.
+    """
+    AP = np.empty((6, 6))
+    PCt = np.empty((6, 2))
+    CP = np.empty((2, 6))
+    K = np.empty((6, 2))
+    S = np.empty((2, 2))
+    for k in range(1, X_hat.shape[0]):
+        ekf_step(X_hat[k - 1], U[k - 1], Y[k], P, Q, R, dt, m, J, lx, ly, lz,
+                 X_hat[k], AP, PCt, CP, K, S)
+
+
+def make_ekf_step(dt, m, J, lx, ly, lz):
+    """Build an EKF step with the model constants baked in.
+
+    The constants are closed over, so Numba freezes them as literals, and
+    ekf_step and its helpers are inlined into the closure at the Numba IR
+    level, so those literals are folded into the arithmetic. Each distinct
+    set of constants gets its own cached specialization.
+    """
+    @njit(cache=True, fastmath=True)
+    def step(x, u, y, P, Q, R, new_x, AP, PCt, CP, K, S):
+        ekf_step(x, u, y, P, Q, R, dt, m, J, lx, ly, lz, new_x, AP, PCt, CP,
+                 K, S)
+    return step
+
+
+def make_ekf_run(dt, m, J, lx, ly, lz):
+    """Build an ekf_run with the model constants baked in, see make_ekf_step.
+    """
+    @njit(cache=True, fastmath=True)
+    def run(U, Y, P, Q, R, X_hat):
+        ekf_run(U, Y, P, Q, R, dt, m, J, lx, ly, lz, X_hat)
+    return run
+
+
+def padded_lim(lo, hi, margin=0.05):
+    """Axis limits spanning [lo, hi] plus a margin on either side."""
+    pad = margin * (hi - lo) if hi > lo else 1.0
+    return lo - pad, hi + pad
+
+
 class Estimator:
     """A base class to represent an estimator.
 
@@ -15,29 +195,36 @@ class Estimator:
 
     Attributes:
     ----------
-        u : list
-            A list of system inputs, where, for the ith data point u[i],
+        u : ndarray
+            An (N, 2) view of the system inputs, where, for the ith data point
+            u[i],
             u[i][1] is the thrust of the quadrotor
             u[i][2] is right wheel rotational speed (rad/s).
-        x : list
-            A list of system states, where, for the ith data point x[i],
+        x : ndarray
+            An (N, 6) view of the system states, where, for the ith data point
+            x[i],
             x[i][0] is translational position in x (m),
             x[i][1] is translational position in z (m),
             x[i][2] is the bearing (rad) of the quadrotor
             x[i][3] is translational velocity in x (m/s),
             x[i][4] is translational velocity in z (m/s),
             x[i][5] is angular velocity (rad/s),
-        y : list
-            A list of system outputs, where, for the ith data point y[i],
+        y : ndarray
+            An (N, 2) view of the system outputs, where, for the ith data point
+            y[i],
             y[i][1] is distance to the landmark (m)
             y[i][2] is relative bearing (rad) w.r.t. the landmark
-        x_hat : list
-            A list of estimated system states. It should follow the same format
-            as x.
+        x_hat : ndarray
+            An (n, 6) view of the first n rows of x_hat_arr, i.e. the states
+            estimated so far. It follows the same format as x.
+        x_hat_arr : ndarray
+            A preallocated (N, 6) array of estimated states, filled in one row
+            at a time by append_hat.
         dt : float
             Update frequency of the estimator.
         fig : Figure
-            matplotlib Figure for real-time plotting.
+            matplotlib Figure for real-time plotting. None until the first
+            call to plot_init or plot_update.
         axd : dict
             A dictionary of matplotlib Axis for real-time plotting.
         ln* : Line
@@ -46,31 +233,32 @@ class Estimator:
             matplotlib Line object for estimated states.
         canvas_title : str
             Title of the real-time plot, which is chosen to be estimator type.
+        verbose : bool
+            Whether to print the running RMSE, MAE and average step time every
+            100 steps.
+        plot_enabled : bool
+            Whether to plot at all. When False, plot_init and plot_update do
+            nothing and the figure is never built.
+        plot_every : int
+            Number of plot_update calls per redraw of the lines.
+        plot_stride : int
+            Only every plot_stride-th point of each line is drawn.
 
     Notes
     ----------
         The landmark is positioned at (0, 5, 5).
     """
     # noinspection PyTypeChecker
-    def __init__(self, is_noisy=False):
-        self.u = []
-        self.x = []
-        self.y = []
-        self.x_hat = []  # Your estimates go here!
-        self.t = []
-        self.fig, self.axd = plt.subplot_mosaic(
-            [['xz', 'phi'],
-             ['xz', 'x'],
-             ['xz', 'z']], figsize=(20.0, 10.0))
-        self.ln_xz, = self.axd['xz'].plot([], 'o-g', linewidth=2, label='True')
-        self.ln_xz_hat, = self.axd['xz'].plot([], 'o-c', label='Estimated')
-        self.ln_phi, = self.axd['phi'].plot([], 'o-g', linewidth=2, label='True')
-        self.ln_phi_hat, = self.axd['phi'].plot([], 'o-c', label='Estimated')
-        self.ln_x, = self.axd['x'].plot([], 'o-g', linewidth=2, label='True')
-        self.ln_x_hat, = self.axd['x'].plot([], 'o-c', label='Estimated')
-        self.ln_z, = self.axd['z'].plot([], 'o-g', linewidth=2, label='True')
-        self.ln_z_hat, = self.axd['z'].plot([], 'o-c', label='Estimated')
+    def __init__(self, is_noisy=False, verbose=False, plot_enabled=True):
+        self.verbose = verbose
+        self.plot_enabled = plot_enabled
+        self.fig = None
+        self.axd = None
         self.canvas_title = 'N/A'
+        # Only every plot_every-th call to plot_update redraws the lines
+        self.plot_every = 20
+        self.frame = 0
+        self.bg = None
 
         # Defined in dynamics.py for the dynamics model
         # m is the mass and J is the moment of inertia of the quadrotor 
@@ -89,16 +277,36 @@ class Estimator:
                 self.data = np.load(f)
 
         self.dt = self.data[-1][0]/self.data.shape[0]
-
+        # t, x, u and y are views into the columns of self.data
+        self.t = self.data[:, 0]
+        self.x = self.data[:, 1:7]
+        self.u = self.data[:, 7:9]
+        self.y = self.data[:, 9:12]
+        # The whole ground truth is known up front, so are the axis limits
+        t, x, z, phi = self.t, self.x[:, 0], self.x[:, 1], self.x[:, 2]
+        self.lims = {
+            name: (*padded_lim(h.min(), h.max()), *padded_lim(v.min(), v.max()))
+            for name, (h, v) in {'xz': (x, z), 'phi': (t, phi),
+                                 'x': (t, x), 'z': (t, z)}.items()}
+        # Draw at most about 1000 points per line
+        self.plot_stride = max(1, self.data.shape[0] // 1000)
+        # Your estimates go here! See append_hat.
+        self.x_hat_arr = np.empty((self.data.shape[0], 6))
+        self.n_hat = 0
+
+    @property
+    def x_hat(self):
+        return self.x_hat_arr[:self.n_hat]
+
+    def append_hat(self, x_hat):
+        """Store x_hat as the next row of x_hat_arr."""
+        self.x_hat_arr[self.n_hat] = x_hat
+        self.n_hat += 1
 
     def run(self):
-        for i, data in enumerate(self.data):
-            self.t.append(np.array(data[0]))
-            self.x.append(np.array(data[1:7]))
-            self.u.append(np.array(data[7:9]))
-            self.y.append(np.array(data[9:12]))
+        for i in range(self.data.shape[0]):
             if i == 0:
-                self.x_hat.append(self.x[-1])
+                self.append_hat(self.x[0])
             else:
                 self.update(i)
         return self.x_hat
@@ -106,7 +314,42 @@ class Estimator:
     def update(self, _):
         raise NotImplementedError
 
+    def _ensure_fig(self):
+        # Building the figure is slow, so only do it once plotting is needed
+        if self.fig is not None:
+            return
+        self.fig, self.axd = plt.subplot_mosaic(
+            [['xz', 'phi'],
+             ['xz', 'x'],
+             ['xz', 'z']], figsize=(20.0, 10.0))
+        self.ln_xz, = self.axd['xz'].plot(
+            [], 'o-g', linewidth=2, label='True', animated=True)
+        self.ln_xz_hat, = self.axd['xz'].plot(
+            [], 'o-c', label='Estimated', animated=True)
+        self.ln_phi, = self.axd['phi'].plot(
+            [], 'o-g', linewidth=2, label='True', animated=True)
+        self.ln_phi_hat, = self.axd['phi'].plot(
+            [], 'o-c', label='Estimated', animated=True)
+        self.ln_x, = self.axd['x'].plot(
+            [], 'o-g', linewidth=2, label='True', animated=True)
+        self.ln_x_hat, = self.axd['x'].plot(
+            [], 'o-c', label='Estimated', animated=True)
+        self.ln_z, = self.axd['z'].plot(
+            [], 'o-g', linewidth=2, label='True', animated=True)
+        self.ln_z_hat, = self.axd['z'].plot(
+            [], 'o-c', label='Estimated', animated=True)
+        # Rasterizing only affects vector exports such as PDF/SVG, where long
+        # traces would otherwise become huge paths. On screen the draw cost is
+        # bounded by plot_stride.
+        for ln in (self.ln_xz, self.ln_xz_hat, self.ln_phi, self.ln_phi_hat,
+                   self.ln_x, self.ln_x_hat, self.ln_z, self.ln_z_hat):
+            ln.set_rasterized(True)
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+
     def plot_init(self):
+        if not self.plot_enabled:
+            return
+        self._ensure_fig()
         self.axd['xz'].set_title(self.canvas_title)
         self.axd['xz'].set_xlabel('x (m)')
         self.axd['xz'].set_ylabel('z (m)')
@@ -121,52 +364,79 @@ class Estimator:
         self.axd['z'].set_ylabel('z (m)')
         self.axd['z'].set_xlabel('t (s)')
         self.axd['z'].legend()
+        # Fixed limits with autoscaling off, so updates never rescale the axes
+        for name, lims in self.lims.items():
+            self.axd[name].set_xlim(lims[:2])
+            self.axd[name].set_ylim(lims[2:])
+            self.axd[name].set_autoscale_on(False)
         plt.tight_layout()
+        self.fig.canvas.draw()
+
+    def on_draw(self, event):
+        # Cache everything but the animated lines, then put the lines back.
+        # savefig to PDF/SVG draws on a vector canvas that cannot blit, so
+        # only cache there, but still draw the lines into the export.
+        if hasattr(event.canvas, 'copy_from_bbox'):
+            self.bg = event.canvas.copy_from_bbox(self.fig.bbox)
+        for ln in (self.ln_xz, self.ln_xz_hat, self.ln_phi, self.ln_phi_hat,
+                   self.ln_x, self.ln_x_hat, self.ln_z, self.ln_z_hat):
+            ln.draw(event.renderer)
+
+    def draw_lines(self):
+        for ln in (self.ln_xz, self.ln_xz_hat, self.ln_phi, self.ln_phi_hat,
+                   self.ln_x, self.ln_x_hat, self.ln_z, self.ln_z_hat):
+            self.fig.draw_artist(ln)
 
     def plot_update(self, _):
-        self.plot_xzline(self.ln_xz, self.x)
-        self.plot_xzline(self.ln_xz_hat, self.x_hat)
-        self.plot_philine(self.ln_phi, self.x)
-        self.plot_philine(self.ln_phi_hat, self.x_hat)
-        self.plot_xline(self.ln_x, self.x)
-        self.plot_xline(self.ln_x_hat, self.x_hat)
-        self.plot_zline(self.ln_z, self.x)
-        self.plot_zline(self.ln_z_hat, self.x_hat)
+        if not self.plot_enabled:
+            return
+        self._ensure_fig()
+        frame = self.frame
+        self.frame += 1
+        if frame % self.plot_every:
+            return
+        x = self.x[:self.n_hat]
+        x_hat = self.x_hat
+        self.plot_xzline(self.ln_xz, x)
+        self.plot_xzline(self.ln_xz_hat, x_hat)
+        self.plot_philine(self.ln_phi, x)
+        self.plot_philine(self.ln_phi_hat, x_hat)
+        self.plot_xline(self.ln_x, x)
+        self.plot_xline(self.ln_x_hat, x_hat)
+        self.plot_zline(self.ln_z, x)
+        self.plot_zline(self.ln_z_hat, x_hat)
+        if self.bg is None:
+            # Nothing cached to blit onto yet
+            self.fig.canvas.draw_idle()
+        else:
+            self.fig.canvas.restore_region(self.bg)
+            self.draw_lines()
+            self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
 
     def plot_xzline(self, ln, data):
         if len(data):
-            x = [d[0] for d in data]
-            z = [d[1] for d in data]
+            x = data[::self.plot_stride, 0]
+            z = data[::self.plot_stride, 1]
             ln.set_data(x, z)
-            self.resize_lim(self.axd['xz'], x, z)
 
     def plot_philine(self, ln, data):
         if len(data):
-            t = self.t
-            phi = [d[2] for d in data]
+            t = self.t[:len(data):self.plot_stride]
+            phi = data[::self.plot_stride, 2]
             ln.set_data(t, phi)
-            self.resize_lim(self.axd['phi'], t, phi)
 
     def plot_xline(self, ln, data):
         if len(data):
-            t = self.t
-            x = [d[0] for d in data]
+            t = self.t[:len(data):self.plot_stride]
+            x = data[::self.plot_stride, 0]
             ln.set_data(t, x)
-            self.resize_lim(self.axd['x'], t, x)
 
     def plot_zline(self, ln, data):
         if len(data):
-            t = self.t
-            z = [d[1] for d in data]
+            t = self.t[:len(data):self.plot_stride]
+            z = data[::self.plot_stride, 1]
             ln.set_data(t, z)
-            self.resize_lim(self.axd['z'], t, z)
-
-    # noinspection PyMethodMayBeStatic
-    def resize_lim(self, ax, x, y):
-        xlim = ax.get_xlim()
-        ax.set_xlim([min(min(x) * 1.05, xlim[0]), max(max(x) * 1.05, xlim[1])])
-        ylim = ax.get_ylim()
-        ax.set_ylim([min(min(y) * 1.05, ylim[0]), max(max(y) * 1.05, ylim[1])])
 
 class OracleObserver(Estimator):
     """Oracle observer which has access to the true state.
@@ -179,12 +449,12 @@ class OracleObserver(Estimator):
     To run the oracle observer:
         $ python drone_estimator_node.py --estimator oracle_observer
     """
-    def __init__(self, is_noisy=False):
-        super().__init__(is_noisy)
+    def __init__(self, is_noisy=False, verbose=False, plot_enabled=True):
+        super().__init__(is_noisy, verbose, plot_enabled)
         self.canvas_title = 'Oracle Observer'
 
-    def update(self, _):
-        self.x_hat.append(self.x[-1])
+    def update(self, i):
+        self.append_hat(self.x[i])
 
 
 class DeadReckoning(Estimator):
@@ -203,39 +473,52 @@ class DeadReckoning(Estimator):
     To run dead reckoning:
         $ python drone_estimator_node.py --estimator dead_reckoning
     """
-    def __init__(self, is_noisy=False):
-        super().__init__(is_noisy)
+    def __init__(self, is_noisy=False, verbose=False, plot_enabled=True):
+        super().__init__(is_noisy, verbose, plot_enabled)
         self.canvas_title = 'Dead Reckoning'
         self.time_step = 0
-        self.old_x = None
+        self.trajectory = None
         self.start_time = time.time()
+        # running sums of squared and absolute errors
+        self.sse = 0.0
+        self.sae = 0.0
+
+    def precompute_trajectory(self):
+        """Integrate the whole dead-reckoning trajectory in one NumPy pass.
+
+        The forward Euler recursion only depends on the inputs and x0, so each
+        state is the initial value plus a cumulative sum of its rate, and the
+        rates can be evaluated for every step at once.
+        """
+        u_1, u_2 = self.u[:, 0], self.u[:, 1]
+        x0, z0, phi0, vx0, vz0, w0 = self.x[0]
+        w = integrate(u_2 / self.J, w0, self.dt)
+        phi = integrate(w, phi0, self.dt)
+        vx = integrate((-u_1 * np.sin(phi)) / self.m, vx0, self.dt)
+        vz = integrate(-constants.g + (u_1 * np.cos(phi)) / self.m, vz0,
+                       self.dt)
+        x = integrate(vx, x0, self.dt)
+        z = integrate(vz, z0, self.dt)
+        self.trajectory = np.column_stack([x, z, phi, vx, vz, w])
 
     def update(self, _):
-        if len(self.x_hat) > 0 and len(self.u) > self.time_step:
+        if self.n_hat > 0:
         # TODO: Your implementation goes here!
         # You may ONLY use self.u and self.x[0] for estimation
             if self.time_step == 0:
-                self.old_x = self.x[0]
-            u_1, u_2 = self.u[self.time_step][0], self.u[self.time_step][1]
-            phi = self.old_x[2]
-            term0 = self.old_x[3]
-            term1 = self.old_x[4]
-            term2 = self.old_x[5]
-            term3 = (-u_1 * np.sin(phi)) / self.m
-            term4 = -constants.g + (u_1 * np.cos(phi)) / self.m
-            term5 = u_2 / self.J
-            new_x = self.old_x + np.array([term0, term1, term2, term3, term4, term5]) * self.dt
-            self.x_hat.append(new_x)
-            self.old_x = new_x
+                self.precompute_trajectory()
             self.time_step += 1
+            new_x = self.trajectory[self.time_step]
+            self.append_hat(new_x)
 
             # calculate error
-            all_errors = []
-            for ground_truth, estimate in zip(self.x, self.x_hat):
-                all_errors.append(np.linalg.norm(np.array(ground_truth[2:4]) - np.array(estimate[2:4])))
-            all_errors = np.array(all_errors)
-            avg_time = (time.time() - self.start_time) / self.time_step
-            print(np.sqrt(np.mean(all_errors**2)), np.mean(np.abs(all_errors)), avg_time)
+            e = np.linalg.norm(self.x[self.time_step][2:4] - new_x[2:4])
+            self.sse += e * e
+            self.sae += e
+            n = self.n_hat
+            if self.verbose and self.time_step % 100 == 0:
+                avg_time = (time.time() - self.start_time) / self.time_step
+                print(np.sqrt(self.sse / n), self.sae / n, avg_time)
 
 # noinspection PyPep8Naming
 class ExtendedKalmanFilter(Estimator):
@@ -263,8 +546,8 @@ class ExtendedKalmanFilter(Estimator):
     To run the extended Kalman filter:
         $ python drone_estimator_node.py --estimator extended_kalman_filter
     """
-    def __init__(self, is_noisy=False):
-        super().__init__(is_noisy)
+    def __init__(self, is_noisy=False, verbose=False, plot_enabled=True):
+        super().__init__(is_noisy, verbose, plot_enabled)
         self.canvas_title = 'Extended Kalman Filter'
         # TODO: Your implementation goes here!
         # You may define the Q, R, and P matrices below.
@@ -272,77 +555,66 @@ class ExtendedKalmanFilter(Estimator):
         self.lx, self.ly, self.lz = self.landmark
         self.old_x = None
         self.start_time = time.time()
-        self.A = np.eye(6)
-        self.Q = np.diag([1, 1, 1, 0.1, 0.1, 0.1])
-        self.R = np.diag([30, 10])
-        self.P = np.diag([5, 5, 5, 1, 1, 1])
+        # running sums of squared and absolute errors
+        self.sse = 0.0
+        self.sae = 0.0
+        self.Q = np.diag([1.0, 1.0, 1.0, 0.1, 0.1, 0.1])
+        self.R = np.diag([30.0, 10.0])
+        self.P = np.diag([5.0, 5.0, 5.0, 1.0, 1.0, 1.0])
+        self.step = make_ekf_step(
+            self.dt, self.m, self.J, self.lx, self.ly, self.lz)
+        self.run_all = make_ekf_run(
+            self.dt, self.m, self.J, self.lx, self.ly, self.lz)
+        # Scratch buffers reused by every step
+        self.AP = np.empty((6, 6))
+        self.PCt = np.empty((6, 2))
+        self.CP = np.empty((2, 6))
+        self.K = np.empty((6, 2))
+        self.S = np.empty((2, 2))
+
+    def run(self):
+        # Filter every sample in one compiled pass instead of calling update
+        # once per data point
+        self.append_hat(self.x[0])
+        # A one-row X_hat has the same types but no steps, so this only
+        # compiles (or loads from cache) run_all and keeps that out of timing
+        self.run_all(self.u, self.y, self.P, self.Q, self.R,
+                     self.x_hat_arr[:1])
+        start_time = time.time()
+        self.run_all(self.u, self.y, self.P, self.Q, self.R, self.x_hat_arr)
+        run_time = time.time() - start_time
+        self.n_hat = self.data.shape[0]
+
+        # calculate error
+        e = np.linalg.norm(self.x[1:, 2:4] - self.x_hat[1:, 2:4], axis=1)
+        self.sse = np.sum(e * e)
+        self.sae = np.sum(e)
+        if self.verbose and self.n_hat > 1:
+            n = self.n_hat
+            avg_time = run_time / (n - 1)
+            print(np.sqrt(self.sse / n), self.sae / n, avg_time)
+        return self.x_hat
+
     # noinspection DuplicatedCode
     def update(self, i):
-        if len(self.x_hat) > 0:
+        if self.n_hat > 0:
             # TODO: Your implementation goes here!
             # You may use self.u, self.y, and self.x[0] for estimation
             if i == 1:
                 self.old_x = self.x_hat[0]
-            u = self.u[i - 1]
-            conditional_x = self.g(self.old_x, u) # extrapolated state 
-            self.A = self.approx_A(self.old_x, u)
-            P = self.A @ self.P @ self.A.T + self.Q
-            self.C = self.approx_C(conditional_x)
-            K = P @ self.C.T @ np.linalg.inv(self.C @ P @ self.C.T + self.R)
-            new_x = conditional_x + K @ (self.h(conditional_x, self.y[i]))
-            self.P = (np.eye(6) - K @ self.C) @ P
-            self.x_hat.append(new_x)
+            # Estimate straight into the next row of x_hat_arr, and P in place
+            new_x = self.x_hat_arr[self.n_hat]
+            self.step(
+                self.old_x, self.u[i - 1], self.y[i], self.P, self.Q, self.R,
+                new_x, self.AP, self.PCt, self.CP, self.K, self.S)
+            self.append_hat(new_x)
             self.old_x = new_x
 
             # calculate error
-            all_errors = []
-            for ground_truth, estimate in zip(self.x, self.x_hat):
-                all_errors.append(np.linalg.norm(np.array(ground_truth[2:4]) - np.array(estimate[2:4])))
-            all_errors = np.array(all_errors)
-            avg_time = (time.time() - self.start_time) / i
-            print(np.sqrt(np.mean(all_errors**2)), np.mean(np.abs(all_errors)), avg_time)
-
-
-    def g(self, x, u):
-        u_1, u_2 = u
-        phi = x[2]
-        dv = x[3]
-        dz = x[4]
-        dphi = x[5]
-        ddv = (-u_1 * np.sin(phi)) / self.m
-        ddz = -constants.g + (u_1 * np.cos(phi)) / self.m
-        ddphi = u_2 / self.J
-        new_x = x + np.array([dv, dz, dphi, ddv, ddz, ddphi]) * self.dt
-        return new_x
-
-    def h(self, x_hat, y_obs):
-        x, z, phi = x_hat[0], x_hat[1], x_hat[2]
-        dist = ((self.lx - x) ** 2 + self.ly ** 2 + (self.lz - z) ** 2) ** 0.5
-        h_x_hat = np.zeros((2, ))
-
-        h_x_hat[0] = dist
-        h_x_hat[1] = phi
-        return y_obs - h_x_hat
-  
-    def approx_A(self, x, u):
-        u_1, _ = u
-        phi, dphi = x[2], x[5]
-        dg = np.eye(6)
-        dg[0, 3] = dg[1, 4] = dg[2, 5] = self.dt
-        dg[3, 2] = -(u_1 * np.cos(phi) * dphi * self.dt) / self.m
-        dg[4, 2] = -(u_1 * np.sin(phi) * dphi * self.dt) / self.m
-        
-        return dg
-
-    
-    def approx_C(self, x):
-        x_i, z = x[0], x[1]
-        dist = ((self.lx - x_i) ** 2 + (self.ly ** 2)+ (self.lz - z) ** 2) ** 0.5
-        dh1_dx1 = -(self.lx - x_i)/dist
-        dh1_dx2 = -(self.lz - z)/dist
-        dh2_dx3 = 1
-        dh_dx = np.zeros((2, 6))
-        dh_dx[0, 0] = dh1_dx1
-        dh_dx[0, 1] = dh1_dx2
-        dh_dx[1, 2] = dh2_dx3
-        return dh_dx
+            e = np.linalg.norm(self.x[i][2:4] - new_x[2:4])
+            self.sse += e * e
+            self.sae += e
+            n = self.n_hat
+            if self.verbose and i % 100 == 0:
+                avg_time = (time.time() - self.start_time) / i
+                print(np.sqrt(self.sse / n), self.sae / n, avg_time)
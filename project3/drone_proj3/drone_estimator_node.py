@@ -3,13 +3,14 @@
 from drone_estimator import \
     OracleObserver, DeadReckoning, ExtendedKalmanFilter
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import argparse
 
 plt.show(block=True)
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--estimator', help='the estimator you want to use')
+parser.add_argument('--verbose', action='store_true',
+                    help='print the running estimation error')
 
 def spin(estimator):
     """
@@ -25,11 +26,12 @@ def spin(estimator):
 
     # noinspection PyUnusedLocal
     estimator.run()
-    anim = FuncAnimation(
-        estimator.fig,
-        estimator.plot_update,
-        init_func=estimator.plot_init,
-        cache_frame_data=False)
+    estimator.plot_init()
+    # plot_update blits the lines itself, so drive it from a plain timer
+    # rather than FuncAnimation, which would redraw the whole figure
+    timer = estimator.fig.canvas.new_timer(interval=200)
+    timer.add_callback(estimator.plot_update, None)
+    timer.start()
     plt.show(block=True)
 
 
@@ -43,14 +45,14 @@ def main():
     args = parser.parse_args()
     estimator_type = args.estimator
     if estimator_type == 'oracle':
-        estimator = OracleObserver(is_noisy=True)
+        estimator = OracleObserver(is_noisy=True, verbose=args.verbose)
     elif estimator_type == 'dr':
-        estimator = DeadReckoning(is_noisy=True)
+        estimator = DeadReckoning(is_noisy=True, verbose=args.verbose)
     elif estimator_type == 'kf':
         raise RuntimeError(
             f'Estimator type: {estimator_type} is not supported for the quadrotor!')
     elif estimator_type == 'ekf':
-        estimator = ExtendedKalmanFilter(is_noisy=True)
+        estimator = ExtendedKalmanFilter(is_noisy=True, verbose=args.verbose)
     else:
         raise RuntimeError(
             'Estimator type {} not supported'.format(estimator_type))